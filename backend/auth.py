@@ -2,8 +2,9 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import bindparam, select
 from sqlalchemy.orm import Session
 from database import get_db
 import models
@@ -13,9 +14,13 @@ import schemas
 SECRET_KEY = "your-secret-key-change-this-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Stream tokens travel in the URL because EventSource cannot set headers, so they are short-lived
+STREAM_TOKEN_EXPIRE_SECONDS = 60
+STREAM_TOKEN_SCOPE = "stream"
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 def verify_password(plain_password, hashed_password):
     """Verify a plain password against its hash"""
@@ -36,9 +41,19 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_stream_token(username: str):
+    """Create a token that only opens the stock event stream"""
+    return create_access_token(
+        data={"sub": username, "scope": STREAM_TOKEN_SCOPE},
+        expires_delta=timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS)
+    )
+
+# Built once; every authenticated request reuses its compiled form
+user_by_username_stmt = select(models.User).where(models.User.username == bindparam("username"))
+
 def get_user(db: Session, username: str):
     """Get user by username"""
-    return db.query(models.User).filter(models.User.username == username).first()
+    return db.execute(user_by_username_stmt, {"username": username}).scalars().first()
 
 def authenticate_user(db: Session, username: str, password: str):
     """Authenticate user credentials"""
@@ -49,11 +64,8 @@ def authenticate_user(db: Session, username: str, password: str):
         return False
     return user
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-):
-    """Get current authenticated user from JWT token"""
+def get_user_from_token(db: Session, token: str, scope: Optional[str] = None):
+    """Get the user a JWT token belongs to; the token's scope must match"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -61,10 +73,9 @@ def get_current_user(
     )
     
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("scope") != scope:
             raise credentials_exception
         token_data = schemas.TokenData(username=username)
     except JWTError:
@@ -75,6 +86,29 @@ def get_current_user(
         raise credentials_exception
     return user
 
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+):
+    """Get current authenticated user from JWT token"""
+    return get_user_from_token(db, credentials.credentials)
+
+def get_stream_user(
+    token: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Session = Depends(get_db)
+):
+    """Authenticate the event stream by bearer header or, for EventSource, a stream token"""
+    if credentials is not None:
+        return get_user_from_token(db, credentials.credentials)
+    if token is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return get_user_from_token(db, token, scope=STREAM_TOKEN_SCOPE)
+
 def get_admin_user(current_user: models.User = Depends(get_current_user)):
     """Ensure current user is an admin"""
     if not current_user.is_admin:
@@ -0,0 +1,92 @@
+"""Benchmark catalog search: SQL path vs the in-memory catalog index.
+
+Usage: python bench_catalog_index.py [rows]   (default 1,000,000)
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+import models
+import crud
+from catalog_index import CatalogIndex
+
+CATEGORIES = ["Traditional", "Bengali", "Premium", "South Indian", "Sugar Free", "Dry Fruit", "Festive", "Fusion"]
+QUERY = {"category": "Bengali", "min_price": 100.0, "max_price": 250.0}
+
+def seed(db, rows):
+    rng = random.Random(42)
+    batch = []
+    for i in range(rows):
+        batch.append({
+            "name": f"Sweet {i}",
+            "category": rng.choice(CATEGORIES),
+            "price": round(rng.uniform(20, 800), 2),
+            "quantity": rng.choice([0, rng.randint(1, 100)]),
+        })
+        if len(batch) == 50000:
+            db.execute(insert(models.Sweet), batch)
+            batch = []
+    if batch:
+        db.execute(insert(models.Sweet), batch)
+    db.commit()
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+def sql_page_and_facets(db):
+    """Best-effort SQL equivalent of one faceted search page"""
+    filters = [
+        models.Sweet.category.ilike(f"%{QUERY['category']}%"),
+        models.Sweet.price >= QUERY["min_price"],
+        models.Sweet.price <= QUERY["max_price"],
+        models.Sweet.quantity > 0,
+    ]
+    db.query(func.count(models.Sweet.id)).filter(*filters).scalar()
+    db.query(models.Sweet).filter(*filters).order_by(models.Sweet.id).limit(100).all()
+    db.query(models.Sweet.category, func.count(models.Sweet.id)).filter(*filters[1:]).group_by(models.Sweet.category).all()
+    db.expunge_all()
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    start = time.perf_counter()
+    seed(db, rows)
+    print(f"Seeded {rows:,} sweets in {time.perf_counter() - start:.1f}s")
+
+    index = CatalogIndex()
+    start = time.perf_counter()
+    index.load(db)
+    print(f"Index load: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def unbounded_sql():
+        crud.search_sweets(db, **QUERY)
+        db.expunge_all()
+
+    results = [
+        ("SQL search_sweets (unbounded ORM rows)", timed(unbounded_sql, 3)),
+        ("SQL count + page + category facet", timed(lambda: sql_page_and_facets(db), 5)),
+        ("Index filter only", timed(lambda: index.search(in_stock=True, **QUERY), 20)),
+        ("Index filter + facets", timed(lambda: index.search(in_stock=True, facets=True, **QUERY), 20)),
+    ]
+    for label, ms in results:
+        print(f"{label:<42} {ms:10.2f} ms")
+
+    ids, _ = index.search(in_stock=True, **QUERY)
+    print(f"Matches: {len(ids):,}")
+    db.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
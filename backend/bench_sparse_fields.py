@@ -0,0 +1,71 @@
+"""Benchmark a catalog grid page: full Sweet entities vs a sparse fieldset.
+
+Usage: python bench_sparse_fields.py [rows]   (default 10,000)
+"""
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+import models
+import schemas
+import crud
+
+GRID_FIELDS = ("id", "name", "price", "quantity", "image_url")
+PAGE_SIZE = 100
+
+def seed(db, rows):
+    rng = random.Random(7)
+    words = "rich soft syrup saffron cardamom ghee pistachio milk jaggery crisp flaky festive".split()
+    db.execute(insert(models.Sweet), [
+        {
+            "name": f"Sweet {i}",
+            "category": rng.choice(["Traditional", "Bengali", "Premium", "South Indian"]),
+            "price": round(rng.uniform(20, 800), 2),
+            "quantity": rng.randint(0, 100),
+            "description": " ".join(rng.choice(words) for _ in range(40)),
+            "image_url": f"https://picsum.photos/300/200?random={i}",
+        }
+        for i in range(rows)
+    ])
+    db.commit()
+
+def measure(db, rows, fields):
+    db_samples, total_samples, payload = [], [], b""
+    for page in range(20):
+        skip = (page * PAGE_SIZE * 7) % max(rows - PAGE_SIZE, 1)
+        start = time.perf_counter()
+        sweets = crud.get_sweets(db, skip=skip, limit=PAGE_SIZE, fields=fields)
+        loaded = time.perf_counter()
+        if fields:
+            model = schemas.sweet_fields_model(fields)
+            body = [model.model_validate(row).model_dump(mode="json") for row in sweets]
+        else:
+            body = [schemas.Sweet.model_validate(sweet).model_dump(mode="json") for sweet in sweets]
+        payload = json.dumps(body).encode()
+        db_samples.append(loaded - start)
+        total_samples.append(time.perf_counter() - start)
+        db.expunge_all()
+    return statistics.median(db_samples) * 1000, statistics.median(total_samples) * 1000, len(payload)
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    seed(db, rows)
+
+    print(f"Grid page of {PAGE_SIZE} from {rows:,} sweets")
+    print(f"{'':<10} {'DB ms':>8} {'total ms':>9} {'bytes':>8}")
+    for label, fields in (("full", None), ("sparse", GRID_FIELDS)):
+        db_ms, total_ms, size = measure(db, rows, fields)
+        print(f"{label:<10} {db_ms:8.2f} {total_ms:9.2f} {size:8,}")
+    db.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
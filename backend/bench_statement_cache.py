@@ -0,0 +1,69 @@
+"""Micro-benchmark per-call overhead of hot CRUD lookups.
+
+Compares the previous db.query(...).filter(...) style with the pre-built
+select() statements and bound parameters now used in crud.py and auth.py.
+
+Usage: python bench_statement_cache.py [calls]   (default 2,000)
+"""
+import statistics
+import sys
+import time
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+import models
+import crud
+import auth
+
+ROWS = 1000
+
+def query_get_sweet(db, sweet_id):
+    return db.query(models.Sweet).filter(models.Sweet.id == sweet_id).first()
+
+def query_get_user(db, username):
+    return db.query(models.User).filter(models.User.username == username).first()
+
+def query_get_user_by_email(db, email):
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def query_get_sweets(db, skip, limit):
+    return db.query(models.Sweet).offset(skip).limit(limit).all()
+
+def per_call_us(db, fn, args_for, calls):
+    samples = []
+    for _ in range(3):
+        start = time.perf_counter()
+        for i in range(calls):
+            fn(db, *args_for(i))
+        samples.append((time.perf_counter() - start) / calls)
+        db.expunge_all()
+    return statistics.median(samples) * 1e6
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.execute(insert(models.Sweet), [
+        {"name": f"Sweet {i}", "category": "Traditional", "price": 100.0, "quantity": 10} for i in range(ROWS)
+    ])
+    db.execute(insert(models.User), [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "hashed_password": "x"} for i in range(ROWS)
+    ])
+    db.commit()
+
+    cases = [
+        ("get_sweet", query_get_sweet, crud.get_sweet, lambda i: (i % ROWS + 1,), calls),
+        ("auth.get_user", query_get_user, auth.get_user, lambda i: (f"user{i % ROWS}",), calls),
+        ("get_user_by_email", query_get_user_by_email, crud.get_user_by_email,
+         lambda i: (f"user{i % ROWS}@example.com",), calls),
+        ("get_sweets (page of 20)", query_get_sweets, crud.get_sweets, lambda i: ((i * 20) % ROWS, 20), calls // 10),
+    ]
+    print(f"{'':<26} {'query us':>9} {'prebuilt us':>12} {'speedup':>8}")
+    for label, before, after, args_for, n in cases:
+        before_us = per_call_us(db, before, args_for, n)
+        after_us = per_call_us(db, after, args_for, n)
+        print(f"{label:<26} {before_us:9.1f} {after_us:12.1f} {before_us / after_us:7.2f}x")
+    db.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
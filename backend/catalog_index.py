@@ -0,0 +1,252 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import models
+
+INDEX_COLUMNS = (
+    models.Sweet.id,
+    models.Sweet.name,
+    models.Sweet.category,
+    models.Sweet.price,
+    models.Sweet.quantity,
+)
+PRICE_HISTOGRAM_BINS = 10
+INITIAL_CAPACITY = 1024
+# Past this many changed sweets a full reload is cheaper than per-row updates
+MAX_INCREMENTAL_CHANGES = 1000
+
+class CatalogIndex:
+    """Columnar in-memory copy of the sweets table for filtered search and facets.
+
+    Rows are stored positionally in numpy arrays; `_rows` maps sweet id to its
+    position. The index remembers the catalog version it reflects and is
+    brought up to date from the change log before each search, so it sees
+    writes made by any process that logs its changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version: Optional[int] = None
+        self._reset(INITIAL_CAPACITY)
+
+    def _reset(self, capacity: int):
+        self._size = 0
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._prices = np.zeros(capacity, dtype=np.float64)
+        self._quantities = np.zeros(capacity, dtype=np.int64)
+        self._category_codes = np.zeros(capacity, dtype=np.int32)
+        self._names: List[str] = []
+        self._rows: Dict[int, int] = {}
+        self._categories: List[str] = []
+        self._category_lookup: Dict[str, int] = {}
+        self._price_order: Optional[np.ndarray] = None
+        self._sorted_prices: Optional[np.ndarray] = None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def version(self) -> Optional[int]:
+        """Catalog version the index reflects, or None before the first load"""
+        return self._version
+
+    def load(self, db: Session, version: int = 0):
+        """Rebuild the whole index from the database.
+
+        version must have been read before the rows, so that changes
+        committed in between are applied again by the next sync.
+        """
+        with self._lock:
+            rows = db.execute(select(*INDEX_COLUMNS)).all()
+            count = len(rows)
+            self._reset(max(INITIAL_CAPACITY, count))
+            if count:
+                ids, names, categories, prices, quantities = zip(*rows)
+                self._ids[:count] = ids
+                self._prices[:count] = prices
+                self._quantities[:count] = [quantity or 0 for quantity in quantities]
+                self._category_codes[:count] = [self._category_code(c) for c in categories]
+                self._names = [(name or "").lower() for name in names]
+                self._rows = {sweet_id: row for row, sweet_id in enumerate(ids)}
+                self._size = count
+            self._version = version
+
+    def sync(self, db: Session, version: int, floor: int):
+        """Bring the index up to a catalog version read from the database.
+
+        Sweets with log entries after the index's version are re-read in
+        their current state, so the order writes landed in does not matter.
+        A full reload happens on first use, when compaction has purged
+        entries the index has not seen (floor), or when too much changed.
+        """
+        with self._lock:
+            if self._version is not None and version <= self._version:
+                return
+            if self._version is None or self._version < floor:
+                self.load(db, version)
+                return
+            changed_ids = db.execute(
+                select(models.SweetChange.sweet_id)
+                .where(models.SweetChange.version > self._version)
+                .distinct()
+            ).scalars().all()
+            if len(changed_ids) > MAX_INCREMENTAL_CHANGES:
+                self.load(db, version)
+                return
+            rows = {
+                row.id: row
+                for row in db.execute(select(*INDEX_COLUMNS).where(models.Sweet.id.in_(changed_ids)))
+            } if changed_ids else {}
+            for sweet_id in changed_ids:
+                if sweet_id in rows:
+                    self.upsert(rows[sweet_id])
+                else:
+                    self.remove(sweet_id)
+            self._version = version
+
+    def _category_code(self, category: str) -> int:
+        code = self._category_lookup.get(category)
+        if code is None:
+            code = len(self._categories)
+            self._categories.append(category)
+            self._category_lookup[category] = code
+        return code
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+        for attr in ("_ids", "_prices", "_quantities", "_category_codes"):
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, attr, new)
+
+    def _append(self, sweet_id, name, category, price, quantity):
+        if self._size == len(self._ids):
+            self._grow()
+        row = self._size
+        self._ids[row] = sweet_id
+        self._names.append((name or "").lower())
+        self._rows[sweet_id] = row
+        self._size += 1
+        self._price_order = None
+        self._set_row(row, category, price, quantity)
+
+    def _set_row(self, row, category, price, quantity):
+        if self._prices[row] != price:
+            self._price_order = None
+        self._prices[row] = price
+        self._quantities[row] = quantity or 0
+        self._category_codes[row] = self._category_code(category)
+
+    def upsert(self, sweet):
+        """Apply a created or updated sweet; any object with the index columns as attributes"""
+        with self._lock:
+            row = self._rows.get(sweet.id)
+            if row is None:
+                self._append(sweet.id, sweet.name, sweet.category, sweet.price, sweet.quantity)
+            else:
+                self._names[row] = (sweet.name or "").lower()
+                self._set_row(row, sweet.category, sweet.price, sweet.quantity)
+
+    def remove(self, sweet_id: int):
+        """Drop a deleted sweet by moving the last row into its slot"""
+        with self._lock:
+            row = self._rows.pop(sweet_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                for array in (self._ids, self._prices, self._quantities, self._category_codes):
+                    array[row] = array[last]
+                self._names[row] = self._names[last]
+                self._rows[moved_id] = row
+            self._names.pop()
+            self._size = last
+            self._price_order = None
+
+    def _price_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._price_order is None:
+            self._price_order = np.argsort(self._prices[:self._size], kind="stable")
+            self._sorted_prices = self._prices[:self._size][self._price_order]
+        return self._price_order, self._sorted_prices
+
+    def _price_rows(self, min_price, max_price) -> Optional[np.ndarray]:
+        """Row positions inside the price range, found by binary search on the sorted prices"""
+        if min_price is None and max_price is None:
+            return None
+        order, sorted_prices = self._price_index()
+        start = 0 if min_price is None else np.searchsorted(sorted_prices, min_price, side="left")
+        end = self._size if max_price is None else np.searchsorted(sorted_prices, max_price, side="right")
+        return order[start:end]
+
+    def _narrow(self, rows: Optional[np.ndarray], column: np.ndarray, predicate) -> np.ndarray:
+        """Keep the rows (None meaning all rows) whose column value satisfies predicate"""
+        if rows is None:
+            return np.flatnonzero(predicate(column[:self._size]))
+        return rows[predicate(column[rows])]
+
+    def _filter_rows(self, rows, category=None, name=None, in_stock=False) -> np.ndarray:
+        """Apply the non-price filters, cheapest first, to a set of row positions"""
+        if category:
+            # Substring match over the (small) category vocabulary, then a vectorized lookup
+            needle = category.lower()
+            allowed = np.array([needle in c.lower() for c in self._categories], dtype=bool)
+            rows = self._narrow(rows, self._category_codes, lambda codes: allowed[codes])
+        if in_stock:
+            rows = self._narrow(rows, self._quantities, lambda quantities: quantities > 0)
+        if rows is None:
+            rows = np.arange(self._size)
+        if name:
+            needle = name.lower()
+            names = self._names
+            rows = rows[np.fromiter((needle in names[row] for row in rows), dtype=bool, count=len(rows))]
+        return rows
+
+    def search(
+        self,
+        name: Optional[str] = None,
+        category: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        in_stock: bool = False,
+        facets: bool = False
+    ):
+        """Return matching sweet ids in id order, plus facet counts if requested.
+
+        Each facet ignores its own filter, so the category counts show what
+        selecting another category would return, and likewise for prices.
+        """
+        with self._lock:
+            price_rows = self._price_rows(min_price, max_price)
+            matched = self._filter_rows(price_rows, category, name, in_stock)
+            ids = np.sort(self._ids[matched])
+
+            facet_counts = None
+            if facets:
+                category_rows = matched if not category else self._filter_rows(price_rows, None, name, in_stock)
+                price_rows = matched if price_rows is None else self._filter_rows(None, category, name, in_stock)
+                facet_counts = {
+                    "categories": self._category_facet(category_rows),
+                    "price_histogram": self._price_facet(price_rows),
+                }
+            return ids, facet_counts
+
+    def _category_facet(self, rows: np.ndarray) -> Dict[str, int]:
+        counts = np.bincount(self._category_codes[rows], minlength=len(self._categories))
+        return {self._categories[code]: int(count) for code, count in enumerate(counts) if count}
+
+    def _price_facet(self, rows: np.ndarray) -> List[dict]:
+        prices = self._prices[rows]
+        if len(prices) == 0:
+            return []
+        counts, edges = np.histogram(prices, bins=PRICE_HISTOGRAM_BINS)
+        return [
+            {"min_price": float(edges[i]), "max_price": float(edges[i + 1]), "count": int(counts[i])}
+            for i in range(len(counts))
+        ]
+
+catalog_index = CatalogIndex()
\ No newline at end of file
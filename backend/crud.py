@@ -1,16 +1,27 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import List, Optional
+from sqlalchemy import Float, Numeric, bindparam, cast, delete, func, insert, or_, select, text, update
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
 import models
 import schemas
-from auth import get_password_hash
+import images
+from auth import get_password_hash, get_user
+from catalog_index import catalog_index
+from compression import catalog_cache
+from events import broadcaster
 
 # User CRUD operations
+# Hot statements are built once at import; the engine's compiled cache then
+# serves every call and only the bound parameter values change
+user_by_email_stmt = select(models.User).where(models.User.email == bindparam("email"))
+sweet_by_id_stmt = select(models.Sweet).where(models.Sweet.id == bindparam("sweet_id"))
+sweets_page_stmt = select(models.Sweet).offset(bindparam("skip")).limit(bindparam("limit"))
+
 def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+    return get_user(db, username)
 
 def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+    return db.execute(user_by_email_stmt, {"email": email}).scalars().first()
 
 def create_user(db: Session, user: schemas.UserCreate):
     hashed_password = get_password_hash(user.password)
@@ -25,34 +36,102 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 # Sweet CRUD operations
-def get_sweets(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Sweet).offset(skip).limit(limit).all()
+def _log_changes(db: Session, sweet_ids: List[int], deleted: bool = False):
+    """Append change log entries as the last write of the caller's transaction.
+
+    Feed cursors assume versions become visible in the order they were
+    assigned. SQLite runs one writer at a time; on PostgreSQL the log table
+    is locked until commit so concurrent writers append, and commit, one
+    after another. Pending row writes are flushed first so the lock is
+    never held while waiting for a row lock.
+    """
+    if sweet_ids:
+        db.flush()
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(text(f"LOCK TABLE {models.SweetChange.__tablename__} IN EXCLUSIVE MODE"))
+        db.execute(insert(models.SweetChange), [
+            {"sweet_id": sweet_id, "deleted": deleted} for sweet_id in sweet_ids
+        ])
+
+def _sweet_changed(db_sweet: models.Sweet):
+    """Propagate a committed sweet write to in-process read paths"""
+    catalog_cache.clear()
+    broadcaster.publish_stock(db_sweet)
+
+def _sweets_changed(rows):
+    """Propagate a committed set-based write; rows carry id, quantity and price"""
+    catalog_cache.clear()
+    broadcaster.publish_stock_batch(rows)
+
+def _sweet_deleted(sweet_id: int):
+    catalog_cache.clear()
+    broadcaster.publish_delete(sweet_id)
+
+def _select_sweet_fields(db: Session, fields: Tuple[str, ...], *criteria, skip: int = 0, limit: Optional[int] = None):
+    """Load only the columns behind the requested fields, as dicts"""
+    columns = {field for field in fields if field != "thumbnails"}
+    if "thumbnails" in fields:
+        columns.add("image_url")
+    query = select(*(getattr(models.Sweet, column) for column in sorted(columns))).where(*criteria)
+    if skip:
+        query = query.offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = [row._asdict() for row in db.execute(query)]
+    if "thumbnails" in fields:
+        for row in rows:
+            row["thumbnails"] = images.thumbnail_urls(row["image_url"])
+    if "image_url" in fields:
+        for row in rows:
+            row["image_url"] = images.public_image_url(row["image_url"])
+    return rows
 
-def get_sweet(db: Session, sweet_id: int):
-    return db.query(models.Sweet).filter(models.Sweet.id == sweet_id).first()
+def get_sweets(db: Session, skip: int = 0, limit: int = 100, fields: Optional[Tuple[str, ...]] = None):
+    """Sweet entities, or dicts of just the given fields when fields is set"""
+    if fields:
+        return _select_sweet_fields(db, fields, skip=skip, limit=limit)
+    return db.execute(sweets_page_stmt, {"skip": skip, "limit": limit}).scalars().all()
+
+def get_sweet(db: Session, sweet_id: int, fields: Optional[Tuple[str, ...]] = None):
+    if fields:
+        rows = _select_sweet_fields(db, fields, models.Sweet.id == sweet_id)
+        return rows[0] if rows else None
+    return db.execute(sweet_by_id_stmt, {"sweet_id": sweet_id}).scalars().first()
 
 def create_sweet(db: Session, sweet: schemas.SweetCreate):
-    db_sweet = models.Sweet(**sweet.dict())
+    sweet_data = sweet.dict()
+    sweet_data["image_url"] = images.normalize_image_url(sweet_data["image_url"])
+    db_sweet = models.Sweet(**sweet_data)
     db.add(db_sweet)
+    db.flush()
+    _log_changes(db, [db_sweet.id])
     db.commit()
     db.refresh(db_sweet)
+    _sweet_changed(db_sweet)
     return db_sweet
 
 def update_sweet(db: Session, sweet_id: int, sweet_update: schemas.SweetUpdate):
-    db_sweet = db.query(models.Sweet).filter(models.Sweet.id == sweet_id).first()
+    db_sweet = get_sweet(db, sweet_id)
     if db_sweet:
         update_data = sweet_update.dict(exclude_unset=True)
+        if "image_url" in update_data:
+            # Clients echo back the absolute URL they were served
+            update_data["image_url"] = images.normalize_image_url(update_data["image_url"])
         for field, value in update_data.items():
             setattr(db_sweet, field, value)
+        _log_changes(db, [sweet_id])
         db.commit()
         db.refresh(db_sweet)
+        _sweet_changed(db_sweet)
     return db_sweet
 
 def delete_sweet(db: Session, sweet_id: int):
-    db_sweet = db.query(models.Sweet).filter(models.Sweet.id == sweet_id).first()
+    db_sweet = get_sweet(db, sweet_id)
     if db_sweet:
         db.delete(db_sweet)
+        _log_changes(db, [sweet_id], deleted=True)
         db.commit()
+        _sweet_deleted(sweet_id)
         return True
     return False
 
@@ -76,20 +155,251 @@ def search_sweets(
     
     return query.all()
 
-def purchase_sweet(db: Session, sweet_id: int, quantity: int = 1):
-    db_sweet = db.query(models.Sweet).filter(models.Sweet.id == sweet_id).first()
+def search_catalog(
+    db: Session,
+    name: Optional[str] = None,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock: bool = False,
+    skip: int = 0,
+    limit: int = 100,
+    facets: bool = False,
+    fields: Optional[Tuple[str, ...]] = None
+):
+    """Search through the in-memory catalog index; same matching rules as search_sweets.
+
+    Returns (page of sweets, total matches, facet counts or None). With
+    fields set, the page holds dicts of just those fields.
+    """
+    catalog_index.sync(db, get_catalog_version(db), get_change_log_floor(db))
+    ids, facet_counts = catalog_index.search(name, category, min_price, max_price, in_stock, facets)
+    page_ids = ids[skip:skip + limit].tolist()
+    sweets = []
+    if page_ids:
+        if fields:
+            # The id column is needed to restore index order even if not requested
+            rows = _select_sweet_fields(db, tuple(set(fields) | {"id"}), models.Sweet.id.in_(page_ids))
+            by_id = {row["id"]: row for row in rows}
+        else:
+            by_id = {
+                sweet.id: sweet
+                for sweet in db.query(models.Sweet).filter(models.Sweet.id.in_(page_ids)).all()
+            }
+        sweets = [by_id[sweet_id] for sweet_id in page_ids if sweet_id in by_id]
+    return sweets, len(ids), facet_counts
+
+def purchase_sweet(
+    db: Session,
+    sweet_id: int,
+    quantity: int = 1,
+    idempotency: Optional[Tuple[int, str, str]] = None
+):
+    db_sweet = get_sweet(db, sweet_id)
     if db_sweet and db_sweet.quantity >= quantity:
         db_sweet.quantity -= quantity
+        if idempotency:
+            _store_idempotent_response(db, db_sweet, *idempotency)
+        _log_changes(db, [sweet_id])
         db.commit()
         db.refresh(db_sweet)
+        _sweet_changed(db_sweet)
         return db_sweet
     return None
 
-def restock_sweet(db: Session, sweet_id: int, quantity: int):
-    db_sweet = db.query(models.Sweet).filter(models.Sweet.id == sweet_id).first()
+def restock_sweet(
+    db: Session,
+    sweet_id: int,
+    quantity: int,
+    idempotency: Optional[Tuple[int, str, str]] = None
+):
+    db_sweet = get_sweet(db, sweet_id)
     if db_sweet:
         db_sweet.quantity += quantity
+        if idempotency:
+            _store_idempotent_response(db, db_sweet, *idempotency)
+        _log_changes(db, [sweet_id])
         db.commit()
         db.refresh(db_sweet)
+        _sweet_changed(db_sweet)
         return db_sweet
-    return None
\ No newline at end of file
+    return None
+
+# Bulk sweet operations
+BULK_CHUNK_SIZE = 500
+sweets_table = models.Sweet.__table__
+SWEET_CHANGE_COLUMNS = (
+    sweets_table.c.id,
+    sweets_table.c.price,
+    sweets_table.c.quantity,
+)
+
+def bulk_change_price(db: Session, category: str, percent: float):
+    """Scale the price of every sweet in a category with one UPDATE"""
+    factor = 1 + percent / 100
+    rows = db.execute(
+        update(sweets_table)
+        .where(sweets_table.c.category == category)
+        # PostgreSQL only has round(numeric, int), so round as numeric and store as float again
+        .values(price=cast(func.round(cast(sweets_table.c.price * factor, Numeric), 2), Float))
+        .returning(*SWEET_CHANGE_COLUMNS)
+    ).all()
+    _log_changes(db, [row.id for row in rows])
+    db.commit()
+    _sweets_changed(rows)
+    return {"updated": len(rows), "missing_ids": []}
+
+def bulk_restock(db: Session, items: List[schemas.RestockItem]):
+    """Add stock to many sweets in one transaction using chunked executemany"""
+    quantities = {}
+    for item in items:
+        quantities[item.id] = quantities.get(item.id, 0) + item.quantity
+
+    sweet_ids = list(quantities)
+    restock = (
+        update(sweets_table)
+        .where(sweets_table.c.id == bindparam("sweet_id"))
+        .values(quantity=sweets_table.c.quantity + bindparam("added"))
+    )
+    rows, missing_ids = [], []
+    for start in range(0, len(sweet_ids), BULK_CHUNK_SIZE):
+        chunk = sweet_ids[start:start + BULK_CHUNK_SIZE]
+        existing = set(db.execute(
+            select(sweets_table.c.id).where(sweets_table.c.id.in_(chunk))
+        ).scalars())
+        missing_ids.extend(sweet_id for sweet_id in chunk if sweet_id not in existing)
+        if not existing:
+            continue
+        db.execute(restock, [
+            {"sweet_id": sweet_id, "added": quantities[sweet_id]}
+            for sweet_id in chunk if sweet_id in existing
+        ])
+        rows.extend(db.execute(
+            select(*SWEET_CHANGE_COLUMNS).where(sweets_table.c.id.in_(existing))
+        ).all())
+    _log_changes(db, [row.id for row in rows])
+    db.commit()
+    _sweets_changed(rows)
+    return {"updated": len(rows), "missing_ids": missing_ids}
+
+# Catalog change feed
+CHANGE_LOG_TOMBSTONE_RETENTION = timedelta(days=30)
+
+def get_catalog_version(db: Session) -> int:
+    """Latest change log version, never below the compaction floor.
+
+    Compaction can purge the newest entry when it is an expired tombstone;
+    the floor keeps the version from going backwards when that happens.
+    """
+    version = db.query(func.max(models.SweetChange.version)).scalar()
+    return max(version or 0, get_change_log_floor(db))
+
+def get_change_log_floor(db: Session) -> int:
+    """Clients synced to a version below this may have missed purged deletes"""
+    floor = db.query(func.max(models.ChangeLogCompaction.purged_through_version)).scalar()
+    return floor or 0
+
+def get_changes_since(db: Session, since: int, limit: int = 500):
+    """Return (entries, has_more) for changes after a version, oldest first"""
+    entries = db.query(models.SweetChange).filter(
+        models.SweetChange.version > since
+    ).order_by(models.SweetChange.version).limit(limit + 1).all()
+    return entries[:limit], len(entries) > limit
+
+def get_change_feed(db: Session, since: int, limit: int = 500) -> dict:
+    """One page of the change feed after a version, each sweet at its current state"""
+    current_version = get_catalog_version(db)
+    if since < get_change_log_floor(db) or since > current_version:
+        return {"version": current_version, "resync_required": True}
+
+    entries, has_more = get_changes_since(db, since, limit)
+    latest = {}
+    for entry in entries:
+        latest[entry.sweet_id] = entry
+    live_ids = [sweet_id for sweet_id, entry in latest.items() if not entry.deleted]
+    sweets = {
+        sweet.id: sweet
+        for sweet in db.query(models.Sweet).filter(models.Sweet.id.in_(live_ids)).all()
+    } if live_ids else {}
+
+    changes = []
+    for sweet_id, entry in latest.items():
+        if entry.deleted:
+            changes.append({"version": entry.version, "id": sweet_id, "deleted": True})
+        elif sweet_id in sweets:
+            # A missing row was deleted after this page; its tombstone follows
+            changes.append({"version": entry.version, "id": sweet_id, "sweet": sweets[sweet_id]})
+    changes.sort(key=lambda change: change["version"])
+    return {
+        "version": entries[-1].version if entries else since,
+        "has_more": has_more,
+        "changes": changes
+    }
+
+def compact_change_log(db: Session) -> int:
+    """Shrink the change log without changing what any client can sync to.
+
+    Entries superseded by a newer entry for the same sweet are dropped, since
+    the feed always serves a sweet's latest state. Tombstones older than the
+    retention period are purged too; the highest purged version is recorded
+    so clients behind it are told to resync.
+    """
+    latest_versions = select(func.max(models.SweetChange.version)).group_by(models.SweetChange.sweet_id)
+    superseded = db.execute(
+        delete(models.SweetChange).where(models.SweetChange.version.not_in(latest_versions))
+    ).rowcount
+
+    cutoff = datetime.utcnow() - CHANGE_LOG_TOMBSTONE_RETENTION
+    expired = models.SweetChange.deleted.is_(True) & (models.SweetChange.created_at < cutoff)
+    purged_through = db.query(func.max(models.SweetChange.version)).filter(expired).scalar()
+    purged = 0
+    if purged_through is not None:
+        purged = db.execute(
+            delete(models.SweetChange).where(expired, models.SweetChange.version <= purged_through)
+        ).rowcount
+        db.add(models.ChangeLogCompaction(purged_through_version=purged_through))
+    db.commit()
+    return superseded + purged
+
+# Idempotency key operations
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+def get_idempotency_record(db: Session, user_id: int, key: str):
+    return db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.user_id == user_id,
+        models.IdempotencyKey.key == key,
+        models.IdempotencyKey.expires_at > datetime.utcnow()
+    ).first()
+
+def _store_idempotent_response(db: Session, db_sweet: models.Sweet, user_id: int, key: str, fingerprint: str):
+    """Record the response for an idempotency key in the caller's transaction.
+
+    A concurrent request with the same key makes the commit fail with an
+    IntegrityError, so at most one of them changes stock.
+    """
+    now = datetime.utcnow()
+    # An expired record for the same key may linger until the next purge
+    db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.user_id == user_id,
+        models.IdempotencyKey.key == key,
+        models.IdempotencyKey.expires_at <= now
+    ).delete(synchronize_session=False)
+
+    # Flush first so server-side values such as updated_at are in the stored body
+    db.flush()
+    db.refresh(db_sweet)
+    db.add(models.IdempotencyKey(
+        user_id=user_id,
+        key=key,
+        request_fingerprint=fingerprint,
+        status_code=200,
+        response_body=schemas.Sweet.model_validate(db_sweet).model_dump_json(),
+        expires_at=now + IDEMPOTENCY_KEY_TTL
+    ))
+
+def purge_expired_idempotency_keys(db: Session) -> int:
+    deleted = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.expires_at <= datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
\ No newline at end of file
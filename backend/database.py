@@ -7,9 +7,14 @@ import os
 # In production, you can change this to PostgreSQL
 SQLALCHEMY_DATABASE_URL = "sqlite:///./sweet_shop.db"
 
+# Compiled statement cache, above the default of 500 so that sparse-field
+# projections (one statement per field set) don't evict the hot CRUD queries
+SQL_COMPILED_CACHE_SIZE = 1200
+
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # Only needed for SQLite
+    connect_args={"check_same_thread": False},  # Only needed for SQLite
+    query_cache_size=SQL_COMPILED_CACHE_SIZE
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,103 @@
+import asyncio
+import json
+from typing import AsyncIterator, Optional, Set
+
+# Per-client buffer; a client this far behind is disconnected instead of buffered
+CLIENT_QUEUE_SIZE = 64
+HEARTBEAT_SECONDS = 15
+RECONNECT_MILLISECONDS = 3000
+
+class Subscription:
+    """A single connected client's event queue"""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+class StockBroadcaster:
+    """Fans out stock change events to connected clients on the event loop.
+
+    Write paths in crud.py run in FastAPI's threadpool, so publishing hands
+    the event over to the loop thread; all subscriber bookkeeping happens
+    on the loop and needs no locking.
+    """
+
+    def __init__(self, queue_size: int = CLIENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Set[Subscription] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(self.queue_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, event: str, payload):
+        """Queue an event for every subscriber; safe to call from any thread"""
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self._subscribers:
+            return
+        message = f"event: {event}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            self._fan_out(message)
+        else:
+            try:
+                loop.call_soon_threadsafe(self._fan_out, message)
+            except RuntimeError:
+                pass  # Loop shut down between the check and the call
+
+    def publish_stock(self, sweet):
+        self.publish("stock", {"id": sweet.id, "quantity": sweet.quantity, "price": sweet.price})
+
+    def publish_stock_batch(self, sweets):
+        """One event for a set-based write, so a bulk update cannot overflow client queues"""
+        if sweets:
+            self.publish("stock-batch", [
+                {"id": sweet.id, "quantity": sweet.quantity, "price": sweet.price} for sweet in sweets
+            ])
+
+    def publish_delete(self, sweet_id: int):
+        self.publish("delete", {"id": sweet_id})
+
+    def _fan_out(self, message: str):
+        for subscription in list(self._subscribers):
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow consumer: drop it and let it resync rather than grow its buffer
+                subscription.dropped = True
+                self._subscribers.discard(subscription)
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Server-Sent Events body for one client, subscribed while it is iterated"""
+        subscription = self.subscribe()
+        try:
+            yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+            while not subscription.dropped:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps idle connections open through proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                if subscription.dropped:
+                    break
+                yield message
+            if subscription.dropped:
+                yield "event: resync\ndata: {}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+broadcaster = StockBroadcaster()
\ No newline at end of file
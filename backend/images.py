@@ -0,0 +1,165 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+from PIL import Image, UnidentifiedImageError
+
+# Storage configuration
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "media"))
+MEDIA_URL = os.getenv("MEDIA_URL", "http://localhost:8000/media")
+# Stored image_url values are relative to the API host; MEDIA_URL is applied when serializing
+MEDIA_PATH = "/media"
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024
+# Decoded size limit; small compressed files can still expand to huge bitmaps
+MAX_IMAGE_PIXELS = 40_000_000
+THUMBNAIL_WIDTHS = (160, 320, 640)
+THUMBNAIL_FORMAT = "webp"
+THUMBNAIL_WORKERS = 2
+
+# Pillow format name -> file extension for accepted uploads
+IMAGE_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+
+ORIGINAL_NAME_RE = re.compile(r"^([0-9a-f]{64})\.(jpg|png|webp|gif)$")
+THUMBNAIL_NAME_RE = re.compile(r"^([0-9a-f]{64})_(\d+)\.%s$" % THUMBNAIL_FORMAT)
+ORIGINAL_URL_RE = re.compile(r"/originals/([0-9a-f]{64})\.(jpg|png|webp|gif)$")
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _shard_path(kind: str, filename: str) -> str:
+    """Files are sharded by the first two hex digits of their digest"""
+    return os.path.join(MEDIA_ROOT, kind, filename[:2], filename)
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def original_path(filename: str) -> str:
+    return _shard_path("originals", filename)
+
+def thumbnail_name(digest: str, width: int) -> str:
+    return f"{digest}_{width}.{THUMBNAIL_FORMAT}"
+
+def thumbnail_path(digest: str, width: int) -> str:
+    return _shard_path("thumbs", thumbnail_name(digest, width))
+
+def store_original(data: bytes) -> str:
+    """Store an uploaded image under its content hash and return the file name.
+
+    Raises ValueError if the data is not an accepted image format or its
+    dimensions exceed MAX_IMAGE_PIXELS.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            image_format = img.format
+            width, height = img.size
+            img.verify()
+    except Image.DecompressionBombError:
+        raise ValueError("Image dimensions are too large")
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise ValueError("File is not a valid image")
+    if image_format not in IMAGE_EXTENSIONS:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError("Image dimensions are too large")
+
+    digest = hashlib.sha256(data).hexdigest()
+    filename = f"{digest}.{IMAGE_EXTENSIONS[image_format]}"
+    path = original_path(filename)
+    # Identical content maps to the same file, so existing originals are reused
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    return filename
+
+def generate_thumbnails(filename: str, widths: Tuple[int, ...] = THUMBNAIL_WIDTHS):
+    """Render resized copies of a stored original (runs in the worker pool)"""
+    digest = ORIGINAL_NAME_RE.match(filename).group(1)
+    with Image.open(original_path(filename)) as img:
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        for width in widths:
+            path = thumbnail_path(digest, width)
+            if os.path.exists(path):
+                continue
+            thumb = img.copy()
+            # Never upscale; keep the aspect ratio by bounding only the width
+            thumb.thumbnail((width, img.height), Image.LANCZOS)
+            buffer = io.BytesIO()
+            thumb.save(buffer, THUMBNAIL_FORMAT, quality=80, method=4)
+            _write_atomic(path, buffer.getvalue())
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # The pool is created from a request thread; forking a multi-threaded
+        # server can hand workers locks that are never released
+        _pool = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+def schedule_thumbnails(filename: str) -> Future:
+    """Queue thumbnail generation for a stored original in the background"""
+    future = _get_pool().submit(generate_thumbnails, filename)
+
+    def log_failure(done: Future):
+        if not done.cancelled() and done.exception() is not None:
+            logger.error("Thumbnail generation failed for %s", filename, exc_info=done.exception())
+
+    future.add_done_callback(log_failure)
+    return future
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def original_url(filename: str) -> str:
+    return f"{MEDIA_URL}/originals/{filename}"
+
+def stored_original_url(filename: str) -> str:
+    """The host-relative image_url saved for a stored original"""
+    return f"{MEDIA_PATH}/originals/{filename}"
+
+def _store_filename(image_url: Optional[str]) -> Optional[str]:
+    match = ORIGINAL_URL_RE.search(image_url) if image_url else None
+    return f"{match.group(1)}.{match.group(2)}" if match else None
+
+def normalize_image_url(image_url: Optional[str]) -> Optional[str]:
+    """Reduce a URL into the local store to its host-relative form before saving"""
+    filename = _store_filename(image_url)
+    return stored_original_url(filename) if filename else image_url
+
+def public_image_url(image_url: Optional[str]) -> Optional[str]:
+    """Absolute URL for an image_url, resolving store images against the current MEDIA_URL"""
+    filename = _store_filename(image_url)
+    return original_url(filename) if filename else image_url
+
+def find_original(digest: str) -> Optional[str]:
+    """Return the stored original's file name for a digest, if any"""
+    for extension in IMAGE_EXTENSIONS.values():
+        filename = f"{digest}.{extension}"
+        if os.path.exists(original_path(filename)):
+            return filename
+    return None
+
+def thumbnail_urls(image_url: Optional[str]) -> Optional[Dict[int, str]]:
+    """Map thumbnail width -> URL for images held in the local store"""
+    if not image_url:
+        return None
+    match = ORIGINAL_URL_RE.search(image_url)
+    if match is None:
+        return None
+    digest = match.group(1)
+    return {width: f"{MEDIA_URL}/thumbs/{thumbnail_name(digest, width)}" for width in THUMBNAIL_WIDTHS}
\ No newline at end of file
@@ -1,19 +1,62 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status, File, Header, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from datetime import timedelta
-from typing import List, Optional
+from typing import List, Optional, Union
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import os
 
 import models
 import schemas
 import crud
 import auth
+import compression
+import images
+from compression import CompressionMiddleware
+from events import broadcaster
 from database import SessionLocal, engine, get_db
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Sweet Shop Management System", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+# Background maintenance
+MAINTENANCE_INTERVAL_SECONDS = 600
+
+def run_maintenance():
+    """Bulk-delete expired rows from bookkeeping tables"""
+    db = SessionLocal()
+    try:
+        crud.purge_expired_idempotency_keys(db)
+        crud.compact_change_log(db)
+    finally:
+        db.close()
+
+async def maintenance_loop():
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            await run_in_threadpool(run_maintenance)
+        except Exception:
+            logger.exception("Maintenance run failed")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    maintenance_task = asyncio.create_task(maintenance_loop())
+    yield
+    maintenance_task.cancel()
+    images.shutdown_pool()
+
+app = FastAPI(title="Sweet Shop Management System", version="1.0.0", lifespan=lifespan)
+
+# Negotiated gzip/brotli for JSON responses
+app.add_middleware(CompressionMiddleware)
 
 # Configure CORS for frontend
 app.add_middleware(
@@ -87,39 +130,145 @@ def create_sweet(
     """Create a new sweet (Admin only)"""
     return crud.create_sweet(db=db, sweet=sweet)
 
+# Largest page the catalog read endpoints serve
+MAX_PAGE_SIZE = 1000
+
+# Sparse fieldsets: `fields=id,name,price` selects only those columns
+def parse_fields(fields: Optional[str]):
+    try:
+        return schemas.parse_sweet_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def serialize_sweets(rows, fields=None):
+    """JSON-ready sweets, trimmed to the selected fields when given"""
+    model = schemas.sweet_fields_model(fields) if fields else schemas.Sweet
+    return [model.model_validate(row).model_dump(mode="json") for row in rows]
+
+def catalog_response(request: Request, db: Session, build) -> Response:
+    """Serve a catalog payload from the compressed body cache, keyed by catalog version"""
+    # Read before the rows so a client syncing from this version cannot miss a change
+    version = crud.get_catalog_version(db)
+    encoding = compression.negotiate_encoding(request.headers.get("accept-encoding"))
+    key = (version, request.url.path, tuple(sorted(request.query_params.multi_items())), encoding)
+    cached = compression.catalog_cache.get(key)
+    if cached is None:
+        body, body_encoding = JSONResponse(build()).body, None
+        if encoding and len(body) >= compression.MINIMUM_SIZE:
+            body, body_encoding = compression.compress(body, encoding), encoding
+        cached = (body, body_encoding)
+        compression.catalog_cache.put(key, *cached)
+
+    body, body_encoding = cached
+    headers = {"X-Catalog-Version": str(version), "Vary": "Accept-Encoding"}
+    if body_encoding:
+        headers["Content-Encoding"] = body_encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/api/sweets", response_model=List[schemas.Sweet])
 def read_sweets(
-    skip: int = 0,
-    limit: int = 100,
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Get all sweets, optionally only the listed fields"""
+    selected = parse_fields(fields)
+    return catalog_response(request, db, lambda: serialize_sweets(
+        crud.get_sweets(db, skip=skip, limit=limit, fields=selected), selected
+    ))
+
+@app.get("/api/sweets/changes", response_model=schemas.ChangeFeed)
+def read_sweet_changes(
+    since: int = 0,
+    limit: int = Query(500, ge=1, le=MAX_PAGE_SIZE),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """Get all sweets"""
-    sweets = crud.get_sweets(db, skip=skip, limit=limit)
-    return sweets
+    """Get sweets changed after a catalog version, with tombstones for deletes.
 
-@app.get("/api/sweets/search", response_model=List[schemas.Sweet])
+    Clients start from the X-Catalog-Version header of a full /api/sweets
+    load. Each changed sweet appears once, with its current state. When
+    resync_required is set the client must reload /api/sweets and continue
+    from the returned version.
+    """
+    return crud.get_change_feed(db, since, limit)
+
+@app.post("/api/sweets/stream/token", response_model=schemas.StreamToken)
+def create_stream_token(current_user: models.User = Depends(auth.get_current_user)):
+    """Get a short-lived token for opening the event stream from a browser EventSource"""
+    return {
+        "token": auth.create_stream_token(current_user.username),
+        "expires_in": auth.STREAM_TOKEN_EXPIRE_SECONDS
+    }
+
+@app.get("/api/sweets/stream")
+async def stream_sweets(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_stream_user)
+):
+    """Stream stock and price changes as Server-Sent Events.
+
+    Authenticate with a bearer header, or with ?token= from
+    /api/sweets/stream/token since EventSource cannot send headers.
+    """
+    # Release the session used for authentication; the stream may stay open for hours
+    db.close()
+    return StreamingResponse(
+        broadcaster.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/sweets/search", response_model=Union[List[schemas.Sweet], schemas.SweetSearchResult])
 def search_sweets(
+    request: Request,
     name: Optional[str] = None,
     category: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
+    in_stock: bool = False,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    facets: bool = False,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """Search sweets by name, category, or price range"""
-    return crud.search_sweets(db, name, category, min_price, max_price)
+    """Search sweets by name, category, price range or availability.
+
+    With facets=true the response also carries the total match count,
+    sweets per category and a price histogram.
+    """
+    selected = parse_fields(fields)
+
+    def build():
+        sweets, total, facet_counts = crud.search_catalog(
+            db, name, category, min_price, max_price, in_stock, skip, limit, facets, selected
+        )
+        items = serialize_sweets(sweets, selected)
+        if facets:
+            return {"items": items, "total": total, "facets": facet_counts}
+        return items
+
+    return catalog_response(request, db, build)
 
 @app.get("/api/sweets/{sweet_id}", response_model=schemas.Sweet)
 def read_sweet(
     sweet_id: int,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """Get a specific sweet"""
-    db_sweet = crud.get_sweet(db, sweet_id=sweet_id)
+    """Get a specific sweet, optionally only the listed fields"""
+    selected = parse_fields(fields)
+    db_sweet = crud.get_sweet(db, sweet_id=sweet_id, fields=selected)
     if db_sweet is None:
         raise HTTPException(status_code=404, detail="Sweet not found")
+    if selected:
+        return JSONResponse(serialize_sweets([db_sweet], selected)[0])
     return db_sweet
 
 @app.put("/api/sweets/{sweet_id}", response_model=schemas.Sweet)
@@ -147,36 +296,155 @@ def delete_sweet(
         raise HTTPException(status_code=404, detail="Sweet not found")
     return {"message": "Sweet deleted successfully"}
 
+# Bulk admin endpoints
+@app.post("/api/sweets/bulk/price", response_model=schemas.BulkUpdateSummary)
+def bulk_change_price(
+    change: schemas.BulkPriceChange,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_admin_user)
+):
+    """Change the price of every sweet in a category by a percentage (Admin only)"""
+    return crud.bulk_change_price(db, change.category, change.percent)
+
+@app.post("/api/sweets/bulk/restock", response_model=schemas.BulkUpdateSummary)
+def bulk_restock(
+    restock: schemas.BulkRestockRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_admin_user)
+):
+    """Restock many sweets in one transaction (Admin only)"""
+    return crud.bulk_restock(db, restock.items)
+
+# Idempotent replays for write endpoints
+def replay_idempotent_response(db: Session, user: models.User, key: str, fingerprint: str):
+    """Return the stored response for an Idempotency-Key, if one was recorded"""
+    record = crud.get_idempotency_record(db, user.id, key)
+    if record is None:
+        return None
+    if record.request_fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request"
+        )
+    return Response(
+        content=record.response_body,
+        status_code=record.status_code,
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+def run_idempotent(db: Session, user: models.User, key: Optional[str], fingerprint: str, operation):
+    """Run a stock write once per Idempotency-Key, replaying the stored response on retries"""
+    if not key:
+        return operation(None)
+    replay = replay_idempotent_response(db, user, key, fingerprint)
+    if replay is not None:
+        return replay
+    try:
+        return operation((user.id, key, fingerprint))
+    except IntegrityError:
+        # A concurrent request with the same key committed first
+        db.rollback()
+        replay = replay_idempotent_response(db, user, key, fingerprint)
+        if replay is None:
+            raise
+        return replay
+
 # Purchase endpoint
 @app.post("/api/sweets/{sweet_id}/purchase", response_model=schemas.Sweet)
 def purchase_sweet(
     sweet_id: int,
     purchase: schemas.PurchaseRequest,
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """Purchase a sweet, decreasing its quantity"""
-    db_sweet = crud.purchase_sweet(db, sweet_id, purchase.quantity)
-    if db_sweet is None:
+    result = run_idempotent(
+        db, current_user, idempotency_key, f"purchase:{sweet_id}:{purchase.quantity}",
+        lambda idempotency: crud.purchase_sweet(db, sweet_id, purchase.quantity, idempotency)
+    )
+    if result is None:
         raise HTTPException(
             status_code=400, 
             detail="Sweet not found or insufficient quantity"
         )
-    return db_sweet
+    return result
 
 # Restock endpoint
 @app.post("/api/sweets/{sweet_id}/restock", response_model=schemas.Sweet)
 def restock_sweet(
     sweet_id: int,
     restock: schemas.RestockRequest,
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_admin_user)
 ):
     """Restock a sweet, increasing its quantity (Admin only)"""
-    db_sweet = crud.restock_sweet(db, sweet_id, restock.quantity)
-    if db_sweet is None:
+    result = run_idempotent(
+        db, current_user, idempotency_key, f"restock:{sweet_id}:{restock.quantity}",
+        lambda idempotency: crud.restock_sweet(db, sweet_id, restock.quantity, idempotency)
+    )
+    if result is None:
         raise HTTPException(status_code=404, detail="Sweet not found")
-    return db_sweet
+    return result
+
+# Image endpoints
+@app.post("/api/sweets/{sweet_id}/image", response_model=schemas.Sweet)
+def upload_sweet_image(
+    sweet_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_admin_user)
+):
+    """Upload a sweet's image into local storage (Admin only)"""
+    if crud.get_sweet(db, sweet_id=sweet_id) is None:
+        raise HTTPException(status_code=404, detail="Sweet not found")
+
+    data = file.file.read(images.MAX_UPLOAD_BYTES + 1)
+    if len(data) > images.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image is too large")
+    try:
+        filename = images.store_original(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    images.schedule_thumbnails(filename)
+    return crud.update_sweet(
+        db, sweet_id, schemas.SweetUpdate(image_url=images.stored_original_url(filename))
+    )
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@app.get("/media/originals/{filename}")
+def read_original_image(filename: str):
+    """Serve a stored original image"""
+    if not images.ORIGINAL_NAME_RE.match(filename):
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = images.original_path(filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    # Content-addressed names never change content, so they can be cached forever
+    return FileResponse(path, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+@app.get("/media/thumbs/{filename}")
+def read_thumbnail_image(filename: str):
+    """Serve a thumbnail, falling back to the original while it is being generated"""
+    match = images.THUMBNAIL_NAME_RE.match(filename)
+    if not match or int(match.group(2)) not in images.THUMBNAIL_WIDTHS:
+        raise HTTPException(status_code=404, detail="Image not found")
+    digest, width = match.group(1), int(match.group(2))
+    path = images.thumbnail_path(digest, width)
+    if os.path.exists(path):
+        return FileResponse(path, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+    original = images.find_original(digest)
+    if original is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return RedirectResponse(
+        url=images.original_url(original),
+        headers={"Cache-Control": "no-cache"}
+    )
 
 if __name__ == "__main__":
     import uvicorn
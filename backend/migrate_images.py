@@ -0,0 +1,76 @@
+import os
+import re
+import sys
+from urllib.parse import unquote, urlparse
+from database import SessionLocal, engine
+import models
+import schemas
+import crud
+import images
+
+def slugify(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+def find_local_image(sweet, image_dir=None):
+    """Locate a local file for a sweet's image.
+
+    The sweet's image_url is used when it is a filesystem path or file:// URL;
+    otherwise image_dir is searched for <id>.<ext> or <slugified-name>.<ext>.
+    """
+    if sweet.image_url:
+        parsed = urlparse(sweet.image_url)
+        if parsed.scheme in ("", "file"):
+            path = unquote(parsed.path)
+            if os.path.isfile(path):
+                return path
+
+    if image_dir:
+        for stem in (str(sweet.id), slugify(sweet.name)):
+            for extension in ("jpg", "jpeg", "png", "webp", "gif"):
+                path = os.path.join(image_dir, f"{stem}.{extension}")
+                if os.path.isfile(path):
+                    return path
+    return None
+
+def migrate_images(image_dir=None):
+    """Move existing sweet images from local files into the image store"""
+    models.Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        migrated, skipped = 0, 0
+        for sweet in db.query(models.Sweet).order_by(models.Sweet.id).all():
+            if sweet.thumbnails is not None:
+                continue  # Already in the store
+
+            path = find_local_image(sweet, image_dir)
+            if path is None:
+                print(f"⚠️  No local image found for '{sweet.name}' (id {sweet.id})")
+                skipped += 1
+                continue
+
+            with open(path, "rb") as f:
+                data = f.read()
+            try:
+                filename = images.store_original(data)
+            except ValueError as e:
+                print(f"⚠️  Skipping '{sweet.name}' ({path}): {e}")
+                skipped += 1
+                continue
+
+            # One-off tool: render thumbnails inline instead of in the worker pool
+            images.generate_thumbnails(filename)
+            # Through crud so the change is logged and running servers see a new catalog version
+            crud.update_sweet(db, sweet.id, schemas.SweetUpdate(image_url=images.stored_original_url(filename)))
+            migrated += 1
+
+        print(f"✅ Migrated {migrated} images into {images.MEDIA_ROOT} ({skipped} skipped)")
+
+    except Exception as e:
+        print(f"❌ Error migrating images: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    migrate_images(sys.argv[1] if len(sys.argv) > 1 else None)
\ No newline at end of file
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, UniqueConstraint
 from sqlalchemy.sql import func
 from database import Base
+import images
 
 class User(Base):
     __tablename__ = "users"
@@ -23,4 +24,39 @@ class Sweet(Base):
     description = Column(String, nullable=True)
     image_url = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    @property
+    def thumbnails(self):
+        """Width-specific thumbnail URLs for locally stored images"""
+        return images.thumbnail_urls(self.image_url)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("user_id", "key"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    key = Column(String, nullable=False)
+    request_fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response_body = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime, index=True, nullable=False)
+
+class SweetChange(Base):
+    __tablename__ = "sweet_changes"
+    # AUTOINCREMENT keeps SQLite from reusing versions after compaction
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    version = Column(Integer, primary_key=True)
+    sweet_id = Column(Integer, index=True, nullable=False)
+    deleted = Column(Boolean, default=False, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ChangeLogCompaction(Base):
+    __tablename__ = "change_log_compactions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    purged_through_version = Column(Integer, nullable=False)
+    compacted_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
@@ -1,6 +1,8 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field, create_model, field_validator
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Type
 from datetime import datetime
+import images
 
 # User Schemas
 class UserCreate(BaseModel):
@@ -47,12 +49,85 @@ class Sweet(BaseModel):
     quantity: int
     description: Optional[str] = None
     image_url: Optional[str] = None
+    thumbnails: Optional[Dict[int, str]] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
+
+    @field_validator("image_url")
+    @classmethod
+    def resolve_image_url(cls, value: Optional[str]) -> Optional[str]:
+        return images.public_image_url(value)
     
     class Config:
         from_attributes = True
 
+# Bulk Operation Schemas
+class BulkPriceChange(BaseModel):
+    category: str
+    # A price can at most be multiplied by 11 in one change and never reach zero
+    percent: float = Field(gt=-100, le=1000, allow_inf_nan=False)
+
+class RestockItem(BaseModel):
+    id: int
+    quantity: int
+
+class BulkRestockRequest(BaseModel):
+    items: List[RestockItem]
+
+class BulkUpdateSummary(BaseModel):
+    updated: int
+    missing_ids: List[int] = []
+
+# Sparse fieldsets
+def parse_sweet_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Parse a comma-separated `fields=` value into Sweet field names, in schema order.
+
+    Raises ValueError naming any field that Sweet does not have.
+    """
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(Sweet.model_fields)
+    if unknown:
+        raise ValueError(f"Unknown sweet fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in Sweet.model_fields if field in requested)
+
+@lru_cache(maxsize=128)
+def sweet_fields_model(fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """A trimmed copy of Sweet with only the given fields"""
+    return create_model(
+        "SweetFields",
+        **{field: (Sweet.model_fields[field].annotation, Sweet.model_fields[field]) for field in fields}
+    )
+
+# Change Feed Schemas
+class SweetChange(BaseModel):
+    version: int
+    id: int
+    deleted: bool = False
+    sweet: Optional[Sweet] = None
+
+class ChangeFeed(BaseModel):
+    version: int
+    resync_required: bool = False
+    has_more: bool = False
+    changes: List[SweetChange] = []
+
+# Search Schemas
+class PriceBucket(BaseModel):
+    min_price: float
+    max_price: float
+    count: int
+
+class SearchFacets(BaseModel):
+    categories: Dict[str, int]
+    price_histogram: List[PriceBucket]
+
+class SweetSearchResult(BaseModel):
+    items: List[Sweet]
+    total: int
+    facets: SearchFacets
+
 # Token Schemas
 class Token(BaseModel):
     access_token: str
@@ -61,6 +136,10 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
+class StreamToken(BaseModel):
+    token: str
+    expires_in: int
+
 # Purchase Schema
 class PurchaseRequest(BaseModel):
     quantity: int = 1
@@ -92,8 +92,11 @@ def clear_database():
     """Clear all existing data"""
     db = SessionLocal()
     try:
-        # Delete all sweets and users
-        db.query(models.Sweet).delete()
+        # Delete all sweets and users; sweets go through crud so the deletes are logged
+        for (sweet_id,) in db.query(models.Sweet.id).all():
+            crud.delete_sweet(db, sweet_id)
+        # Existing tables may predate ON DELETE CASCADE on idempotency_keys.user_id
+        db.query(models.IdempotencyKey).delete()
         db.query(models.User).delete()
         db.commit()
         print("✅ Database cleared successfully!")
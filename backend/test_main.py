@@ -1,10 +1,18 @@
+import asyncio
+import io
 import pytest
+from datetime import datetime, timedelta
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from database import Base, get_db
 from main import app
+import auth
+import crud
+import compression
+import images
 import models
+from events import StockBroadcaster
 
 # Create test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -35,6 +43,26 @@ def test_user_data():
         "password": "testpassword"
     }
 
+@pytest.fixture
+def admin_headers(client: TestClient):
+    admin_data = {
+        "username": "adminuser",
+        "email": "admin@example.com",
+        "password": "adminpassword"
+    }
+    client.post("/api/auth/register", json=admin_data)
+    db = TestingSessionLocal()
+    try:
+        db.query(models.User).filter(models.User.username == admin_data["username"]).update({"is_admin": True})
+        db.commit()
+    finally:
+        db.close()
+    login_response = client.post("/api/auth/login", json={
+        "username": admin_data["username"],
+        "password": admin_data["password"]
+    })
+    return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
 @pytest.fixture
 def test_sweet_data():
     return {
@@ -148,4 +176,314 @@ def test_search_sweets(client: TestClient, test_user_data, test_sweet_data):
     assert response.status_code == 200
     data = response.json()
     assert len(data) >= 1
-    assert "Gulab" in data[0]["name"]
\ No newline at end of file
+    assert "Gulab" in data[0]["name"]
+
+def test_upload_sweet_image(client: TestClient, admin_headers, test_sweet_data, tmp_path, monkeypatch):
+    """Test uploading an image and serving its thumbnails"""
+    from PIL import Image
+    monkeypatch.setattr(images, "MEDIA_ROOT", str(tmp_path))
+    monkeypatch.setattr(images, "schedule_thumbnails", images.generate_thumbnails)
+
+    sweet_id = client.post("/api/sweets", json=test_sweet_data, headers=admin_headers).json()["id"]
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 600), "orange").save(buffer, "PNG")
+
+    response = client.post(
+        f"/api/sweets/{sweet_id}/image",
+        files={"file": ("sweet.png", buffer.getvalue(), "image/png")},
+        headers=admin_headers
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert "/media/originals/" in data["image_url"]
+    assert set(data["thumbnails"]) == {str(width) for width in images.THUMBNAIL_WIDTHS}
+
+    thumbnail_url = data["thumbnails"]["320"]
+    response = client.get(thumbnail_url[thumbnail_url.index("/media/"):])
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+    assert Image.open(io.BytesIO(response.content)).width == 320
+
+    # The stored URL is host-relative, so a new MEDIA_URL applies to existing images
+    db = TestingSessionLocal()
+    try:
+        assert db.get(models.Sweet, sweet_id).image_url.startswith("/media/originals/")
+    finally:
+        db.close()
+    monkeypatch.setattr(images, "MEDIA_URL", "https://cdn.example.com/media")
+    response = client.get(f"/api/sweets/{sweet_id}", headers=admin_headers)
+    assert response.json()["image_url"].startswith("https://cdn.example.com/media/originals/")
+
+    response = client.post(
+        f"/api/sweets/{sweet_id}/image",
+        files={"file": ("sweet.png", b"not an image", "image/png")},
+        headers=admin_headers
+    )
+    assert response.status_code == 400
+
+    monkeypatch.setattr(images, "MAX_IMAGE_PIXELS", 800 * 600 - 1)
+    response = client.post(
+        f"/api/sweets/{sweet_id}/image",
+        files={"file": ("sweet.png", buffer.getvalue(), "image/png")},
+        headers=admin_headers
+    )
+    assert response.status_code == 400
+
+def test_stock_broadcaster():
+    """Test stock event fan-out and slow-consumer dropping"""
+    async def scenario():
+        broadcaster = StockBroadcaster(queue_size=2)
+        fast, slow = broadcaster.stream(), broadcaster.stream()
+        assert (await fast.__anext__()).startswith("retry:")
+        assert (await slow.__anext__()).startswith("retry:")
+        assert broadcaster.subscriber_count == 2
+
+        # Write paths publish from threadpool threads
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, broadcaster.publish, "stock", {"id": 1, "quantity": 5, "price": 10.0})
+        assert await fast.__anext__() == 'event: stock\ndata: {"id":1,"quantity":5,"price":10.0}\n\n'
+
+        # The slow client never reads, so it overflows and gets dropped
+        for quantity in range(3):
+            broadcaster.publish("stock", {"id": 1, "quantity": quantity, "price": 10.0})
+            assert "stock" in await fast.__anext__()
+        assert broadcaster.subscriber_count == 1
+        assert (await slow.__anext__()).startswith("event: resync")
+        await fast.aclose()
+        assert broadcaster.subscriber_count == 0
+
+    asyncio.run(scenario())
+
+def test_stream_token(client: TestClient, admin_headers):
+    """Test the short-lived token that lets a browser EventSource open the stream"""
+    response = client.post("/api/sweets/stream/token", headers=admin_headers)
+    assert response.status_code == 200
+    token = response.json()["token"]
+
+    # Stream tokens open the stream and nothing else
+    response = client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401
+    access_token = admin_headers["Authorization"].split()[1]
+    assert client.get(f"/api/sweets/stream?token={access_token}").status_code == 401
+    assert client.get("/api/sweets/stream").status_code == 401
+
+    db = TestingSessionLocal()
+    try:
+        assert auth.get_stream_user(token=token, credentials=None, db=db).username == "adminuser"
+    finally:
+        db.close()
+
+def test_idempotent_purchase(client: TestClient, admin_headers, test_sweet_data):
+    """Test that retried purchases with an Idempotency-Key only change stock once"""
+    sweet_id = client.post("/api/sweets", json=test_sweet_data, headers=admin_headers).json()["id"]
+    headers = {**admin_headers, "Idempotency-Key": "purchase-retry-1"}
+
+    first = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=headers)
+    retry = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert first.json()["quantity"] == test_sweet_data["quantity"] - 3
+
+    response = client.get(f"/api/sweets/{sweet_id}", headers=admin_headers)
+    assert response.json()["quantity"] == test_sweet_data["quantity"] - 3
+
+    # Reusing the key for a different request is rejected
+    response = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 1}, headers=headers)
+    assert response.status_code == 422
+
+    db = TestingSessionLocal()
+    try:
+        db.query(models.IdempotencyKey).update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+        assert crud.purge_expired_idempotency_keys(db) >= 1
+        assert db.query(models.IdempotencyKey).count() == 0
+    finally:
+        db.close()
+
+def test_search_facets(client: TestClient, admin_headers):
+    """Test in-stock filtering and facet counts from the catalog index"""
+    sweets = [
+        {"name": "Kulfi", "category": "FacetFrozen", "price": 50.0, "quantity": 0},
+        {"name": "Falooda", "category": "FacetFrozen", "price": 90.0, "quantity": 5},
+        {"name": "Gajar Halwa", "category": "FacetWarm", "price": 70.0, "quantity": 3},
+    ]
+    ids = [client.post("/api/sweets", json=sweet, headers=admin_headers).json()["id"] for sweet in sweets]
+
+    response = client.get("/api/sweets/search?category=FacetFrozen&in_stock=true&facets=true", headers=admin_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["name"] for item in data["items"]] == ["Falooda"]
+    assert data["total"] == 1
+    # The category facet ignores the category filter but still applies in_stock
+    assert data["facets"]["categories"]["FacetFrozen"] == 1
+    assert data["facets"]["categories"]["FacetWarm"] == 1
+    assert sum(bucket["count"] for bucket in data["facets"]["price_histogram"]) == 1
+
+    # Logged writes are applied to the index before the next search
+    client.post(f"/api/sweets/{ids[1]}/purchase", json={"quantity": 5}, headers=admin_headers)
+    client.delete(f"/api/sweets/{ids[2]}", headers=admin_headers)
+    response = client.get("/api/sweets/search?category=Facet&min_price=40&max_price=100&in_stock=true", headers=admin_headers)
+    assert response.json() == []
+    response = client.get("/api/sweets/search?category=Facet&min_price=40&max_price=60", headers=admin_headers)
+    assert [item["id"] for item in response.json()] == [ids[0]]
+
+    # Paging bounds are validated rather than passed to array slicing
+    for query in ("skip=-5", "limit=-1", "limit=0", "limit=1001"):
+        assert client.get(f"/api/sweets/search?{query}", headers=admin_headers).status_code == 422
+    assert client.get("/api/sweets?skip=-1", headers=admin_headers).status_code == 422
+
+def test_search_sees_other_process_writes(client: TestClient, admin_headers):
+    """Test that the catalog index catches up with logged writes it did not make"""
+    sold_out = client.post("/api/sweets", json={"name": "Remote Rasgulla", "category": "Remote", "price": 60.0, "quantity": 4}, headers=admin_headers).json()
+    gone = client.post("/api/sweets", json={"name": "Remote Rabri", "category": "Remote", "price": 80.0, "quantity": 2}, headers=admin_headers).json()
+    response = client.get("/api/sweets/search?category=Remote&in_stock=true", headers=admin_headers)
+    assert [item["id"] for item in response.json()] == [sold_out["id"], gone["id"]]
+
+    # Write from another session the way another worker would, bypassing this process
+    db = TestingSessionLocal()
+    try:
+        db.query(models.Sweet).filter(models.Sweet.id == sold_out["id"]).update({"quantity": 0})
+        db.query(models.Sweet).filter(models.Sweet.id == gone["id"]).delete()
+        added = models.Sweet(name="Remote Rasmalai", category="Remote", price=90.0, quantity=3)
+        db.add(added)
+        db.flush()
+        db.add_all([
+            models.SweetChange(sweet_id=sold_out["id"]),
+            models.SweetChange(sweet_id=gone["id"], deleted=True),
+            models.SweetChange(sweet_id=added.id),
+        ])
+        db.commit()
+        added_id = added.id
+    finally:
+        db.close()
+
+    data = client.get("/api/sweets/search?category=Remote&in_stock=true&facets=true", headers=admin_headers).json()
+    assert [item["id"] for item in data["items"]] == [added_id]
+    assert data["total"] == 1
+
+def test_bulk_operations(client: TestClient, admin_headers):
+    """Test category price changes and multi-sweet restocks"""
+    sweets = [
+        {"name": "Bulk Barfi", "category": "BulkCategory", "price": 100.0, "quantity": 1},
+        {"name": "Bulk Peda", "category": "BulkCategory", "price": 50.0, "quantity": 2},
+    ]
+    ids = [client.post("/api/sweets", json=sweet, headers=admin_headers).json()["id"] for sweet in sweets]
+
+    response = client.post("/api/sweets/bulk/price", json={"category": "BulkCategory", "percent": 5}, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json() == {"updated": 2, "missing_ids": []}
+    for percent in ("Infinity", "NaN", 1e308, -100):
+        response = client.post("/api/sweets/bulk/price", json={"category": "BulkCategory", "percent": percent}, headers=admin_headers)
+        assert response.status_code == 422
+
+    items = [{"id": ids[0], "quantity": 10}, {"id": ids[1], "quantity": 4}, {"id": ids[0], "quantity": 1}, {"id": 999999, "quantity": 3}]
+    response = client.post("/api/sweets/bulk/restock", json={"items": items}, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json() == {"updated": 2, "missing_ids": [999999]}
+
+    data = client.get("/api/sweets/search?category=BulkCategory", headers=admin_headers).json()
+    assert [(sweet["price"], sweet["quantity"]) for sweet in data] == [(105.0, 12), (52.5, 6)]
+
+def test_change_feed(client: TestClient, admin_headers, monkeypatch):
+    """Test incremental sync from the catalog change log"""
+    response = client.get("/api/sweets", headers=admin_headers)
+    version = int(response.headers["x-catalog-version"])
+
+    kept = client.post("/api/sweets", json={"name": "Feed Modak", "category": "Feed", "price": 40.0, "quantity": 9}, headers=admin_headers).json()
+    removed = client.post("/api/sweets", json={"name": "Feed Chikki", "category": "Feed", "price": 30.0, "quantity": 4}, headers=admin_headers).json()
+    client.post(f"/api/sweets/{kept['id']}/purchase", json={"quantity": 2}, headers=admin_headers)
+    client.delete(f"/api/sweets/{removed['id']}", headers=admin_headers)
+
+    feed = client.get(f"/api/sweets/changes?since={version}", headers=admin_headers).json()
+    assert not feed["resync_required"] and not feed["has_more"]
+    assert [(change["id"], change["deleted"]) for change in feed["changes"]] == [(kept["id"], False), (removed["id"], True)]
+    assert feed["changes"][0]["sweet"]["quantity"] == 7
+    assert feed["version"] > version
+
+    feed = client.get(f"/api/sweets/changes?since={feed['version']}", headers=admin_headers).json()
+    assert feed["changes"] == []
+
+    # A page size that could never advance the cursor is rejected
+    for limit in (0, -1, 1001):
+        assert client.get(f"/api/sweets/changes?since={version}&limit={limit}", headers=admin_headers).status_code == 422
+
+    # Purging the tombstone forces clients that have not seen it to resync
+    monkeypatch.setattr(crud, "CHANGE_LOG_TOMBSTONE_RETENTION", timedelta(days=-1))
+    db = TestingSessionLocal()
+    try:
+        crud.compact_change_log(db)
+    finally:
+        db.close()
+    feed = client.get(f"/api/sweets/changes?since={version}", headers=admin_headers).json()
+    assert feed["resync_required"]
+
+def test_catalog_version_after_tombstone_purge(client: TestClient, admin_headers, monkeypatch):
+    """Test that purging the newest entry, a tombstone, does not move the version back"""
+    client.post("/api/sweets", json={"name": "Purge Peda", "category": "Purge", "price": 20.0, "quantity": 1}, headers=admin_headers)
+    removed = client.post("/api/sweets", json={"name": "Purge Pinni", "category": "Purge", "price": 25.0, "quantity": 1}, headers=admin_headers).json()
+    client.delete(f"/api/sweets/{removed['id']}", headers=admin_headers)
+    before = int(client.get("/api/sweets", headers=admin_headers).headers["x-catalog-version"])
+
+    monkeypatch.setattr(crud, "CHANGE_LOG_TOMBSTONE_RETENTION", timedelta(days=-1))
+    db = TestingSessionLocal()
+    try:
+        crud.compact_change_log(db)
+    finally:
+        db.close()
+    after = int(client.get("/api/sweets", headers=admin_headers).headers["x-catalog-version"])
+    assert after >= before
+
+    feed = client.get(f"/api/sweets/changes?since={after}", headers=admin_headers).json()
+    assert not feed["resync_required"]
+    assert feed["changes"] == []
+
+def test_sparse_fieldsets(client: TestClient, admin_headers):
+    """Test fields= projections on list, search and detail endpoints"""
+    sweet = {"name": "Sparse Sohan Halwa", "category": "Sparse", "price": 220.0, "quantity": 6, "description": "Dense and chewy"}
+    sweet_id = client.post("/api/sweets", json=sweet, headers=admin_headers).json()["id"]
+
+    response = client.get("/api/sweets?fields=id,name,price&limit=1000", headers=admin_headers)
+    assert response.status_code == 200
+    assert "x-catalog-version" in response.headers
+    assert {"id": sweet_id, "name": sweet["name"], "price": sweet["price"]} in response.json()
+    assert all(set(item) == {"id", "name", "price"} for item in response.json())
+
+    response = client.get("/api/sweets/search?category=Sparse&fields=name,quantity,thumbnails", headers=admin_headers)
+    assert response.json() == [{"name": sweet["name"], "quantity": 6, "thumbnails": None}]
+
+    response = client.get(f"/api/sweets/{sweet_id}?fields=description", headers=admin_headers)
+    assert response.json() == {"description": "Dense and chewy"}
+
+    response = client.get("/api/sweets?fields=name,secret", headers=admin_headers)
+    assert response.status_code == 400
+
+def test_compressed_catalog_cache(client: TestClient, admin_headers):
+    """Test negotiated compression and reuse of cached catalog bodies"""
+    version = client.get("/api/sweets", headers=admin_headers).headers["x-catalog-version"]
+    for i in range(10):
+        client.post("/api/sweets", json={"name": f"Gzip Gujiya {i}", "category": "Gzip", "price": 10.0 + i, "quantity": 1}, headers=admin_headers)
+
+    headers = {**admin_headers, "Accept-Encoding": "gzip"}
+    first = client.get("/api/sweets?limit=1000", headers=headers)
+    assert first.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in first.headers["vary"]
+    cached_entries = len(compression.catalog_cache)
+    second = client.get("/api/sweets?limit=1000", headers=headers)
+    assert second.json() == first.json()
+    assert len(compression.catalog_cache) == cached_entries
+
+    identity = client.get("/api/sweets?limit=1000", headers={**admin_headers, "Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+    assert identity.json() == first.json()
+
+    # A write invalidates the cache and bumps the catalog version
+    client.post(f"/api/sweets/{first.json()[-1]['id']}/restock", json={"quantity": 1}, headers=admin_headers)
+    assert len(compression.catalog_cache) == 0
+    third = client.get("/api/sweets?limit=1000", headers=headers)
+    assert int(third.headers["x-catalog-version"]) > int(first.headers["x-catalog-version"])
+    assert third.json()[-1]["quantity"] == first.json()[-1]["quantity"] + 1
+
+    # Other JSON endpoints are compressed by the middleware
+    response = client.get(f"/api/sweets/changes?since={version}", headers=headers)
+    assert response.headers["content-encoding"] == "gzip"
\ No newline at end of file
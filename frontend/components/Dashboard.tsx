@@ -11,9 +11,16 @@ interface Sweet {
   quantity: number;
   description: string;
   image_url?: string;
+  thumbnails?: Record<string, string>;
   created_at: string;
 }
 
+interface StockUpdate {
+  id: number;
+  quantity: number;
+  price: number;
+}
+
 interface CartItem {
   sweet: Sweet;
   quantity: number;
@@ -48,6 +55,70 @@ const Dashboard: React.FC = () => {
     filterSweets();
   }, [sweets, searchTerm, categoryFilter, priceFilter]);
 
+  // Live stock updates; EventSource cannot send headers, so it opens with a short-lived stream token
+  useEffect(() => {
+    let source: EventSource | null = null;
+    let retryTimer: ReturnType<typeof setTimeout> | undefined;
+    let stopped = false;
+
+    const applyStock = (updates: StockUpdate[]) => {
+      const byId = new Map(updates.map(update => [update.id, update]));
+      setSweets(prev => prev.map(sweet => {
+        const update = byId.get(sweet.id);
+        return update ? { ...sweet, quantity: update.quantity, price: update.price } : sweet;
+      }));
+    };
+
+    const reconnect = () => {
+      if (!stopped) {
+        retryTimer = setTimeout(() => {
+          // Events may have been missed while disconnected
+          fetchSweets();
+          connect();
+        }, 3000);
+      }
+    };
+
+    const connect = async () => {
+      try {
+        const response = await axios.post(
+          'http://localhost:8000/api/sweets/stream/token',
+          {},
+          { headers: { Authorization: `Bearer ${token}` } }
+        );
+        if (stopped) return;
+        source = new EventSource(
+          `http://localhost:8000/api/sweets/stream?token=${encodeURIComponent(response.data.token)}`
+        );
+        source.addEventListener('stock', (e) => applyStock([JSON.parse((e as MessageEvent).data)]));
+        source.addEventListener('stock-batch', (e) => applyStock(JSON.parse((e as MessageEvent).data)));
+        source.addEventListener('delete', (e) => {
+          const { id } = JSON.parse((e as MessageEvent).data);
+          setSweets(prev => prev.filter(sweet => sweet.id !== id));
+        });
+        source.addEventListener('resync', () => fetchSweets());
+        source.onerror = () => {
+          // EventSource retries dropped connections itself, but gives up once its
+          // (expired) stream token is rejected; start over with a new token then
+          if (source && source.readyState === EventSource.CLOSED) {
+            source.close();
+            reconnect();
+          }
+        };
+      } catch (error) {
+        console.error('Failed to open stock stream:', error);
+        reconnect();
+      }
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    };
+  }, [token]);
+
   const fetchSweets = async () => {
     try {
       const response = await axios.get('http://localhost:8000/api/sweets', {
@@ -310,6 +381,10 @@ const Dashboard: React.FC = () => {
             <div className="sweet-image">
               <img 
                 src={sweet.image_url || 'https://via.placeholder.com/300x200'} 
+                srcSet={sweet.thumbnails
+                  ? Object.entries(sweet.thumbnails).map(([width, url]) => `${url} ${width}w`).join(', ')
+                  : undefined}
+                sizes="300px"
                 alt={sweet.name}
                 onError={(e) => {
                   (e.target as HTMLImageElement).src = 'https://via.placeholder.com/300x200';